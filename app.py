@@ -1,9 +1,20 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from config import Config
-from models import db, User, Quizzes, Questions, Results
+from models import db, User, Organizations, Quizzes, Questions, Results, Jobs
+from adaptive import adaptive_engine
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_migrate import Migrate
 from dotenv import load_dotenv
+from search import search_quizzes, invalidate_search
+from replicas import replica_router, note_write, use_primary, wrote_recently
+from archive import results_cli, archived_results_for_user
+from export import EXPORT_FORMATS, export_results
+from compression import Compression
+from jobs import JOB_HANDLERS, enable_sqlite_wal, enqueue, jobs_cli
+from profiling import profiler
+from tenants import tenant_resolver
+from sqlalchemy import func
+import hmac
 import logging
 
 # Load environment variables
@@ -16,14 +27,52 @@ app.config.from_object(Config)
 # Initialize the database and migration tools
 db.init_app(app)
 migrate = Migrate(app, db)
+replica_router.init_app(app, db)
+app.cli.add_command(results_cli)
+app.cli.add_command(jobs_cli)
+enable_sqlite_wal(app, db)
+compression = Compression(app)
+tenant_resolver.init_app(app)
+
+# SQL profiling hooks are only installed when enabled, so it costs nothing otherwise
+if app.config["SQL_PROFILING"]:
+    profiler.init_app(app, db)
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 
+# Upper bound for page sizes on paginated endpoints
+MAX_PER_PAGE = 100
+
+# Fields clients can pick with ?fields= on the quiz endpoints
+QUIZ_LIST_FIELDS = ("id", "title", "description", "questions_count")
+QUIZ_DETAIL_FIELDS = ("id", "title", "description", "questions")
+
+# Returns an error response unless the request carries the admin token
+def check_admin():
+    token = app.config["ADMIN_API_TOKEN"]
+    if not token:
+        return jsonify({"message": "Admin endpoints are disabled"}), 403
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token):
+        return jsonify({"message": "Invalid admin token"}), 403
+    return None
+
+# Parses ?fields=a,b into (fields, error response); all fields if not given
+def requested_fields(allowed):
+    fields = request.args.get("fields")
+    if not fields:
+        return set(allowed), None
+
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        return None, (jsonify({"message": f"Unknown fields: {', '.join(sorted(unknown))}"}), 400)
+    return requested, None
+
 # Create database tables if they don't exist
 def create_tables():
     with app.app_context():
-        db.create_all()
+        db.create_all(bind_key=None)  # Replicas get their schema from the primary
 
 # User registration route
 @app.route("/register", methods=["POST"])
@@ -72,6 +121,35 @@ def login():
         logging.error(f"Error during login: {str(e)}")
         return jsonify({"message": str(e)}), 500
 
+# Create an organization (admin only); quizzes are created in the
+# organization named by the X-Tenant header
+@app.route("/organizations", methods=["POST"])
+def create_organization():
+    try:
+        error = check_admin()
+        if error:
+            return error
+
+        data = request.get_json()
+        name = data.get("name")
+        slug = data.get("slug")
+
+        if not name or not slug:
+            return jsonify({"message": "Organization name and slug are required"}), 400
+
+        if Organizations.query.filter((Organizations.name == name) | (Organizations.slug == slug)).first():
+            return jsonify({"message": "Organization already exists"}), 400
+
+        organization = Organizations(name=name, slug=slug)
+        db.session.add(organization)
+        db.session.commit()
+
+        logging.debug(f"Organization created with ID {organization.id}")
+        return jsonify({"message": "Organization created successfully", "organization_id": organization.id}), 201
+    except Exception as e:
+        logging.error(f"Error creating organization: {str(e)}")
+        return jsonify({"message": str(e)}), 500
+
 # Create a new quiz
 @app.route("/quizzes", methods=["POST"])
 def create_quiz():
@@ -79,13 +157,14 @@ def create_quiz():
         data = request.get_json()
         title = data.get("title")
         description = data.get("description")
+        user_id = data.get("user_id")
         questions_data = data.get("questions")
 
         if not title or not questions_data:
             return jsonify({"message": "Quiz title and questions are required"}), 400
 
         # Create the quiz
-        quiz = Quizzes(title=title, description=description)
+        quiz = Quizzes(title=title, description=description, user_id=user_id, tenant_id=g.tenant_id)
         db.session.add(quiz)
         db.session.flush()  # To get the quiz ID for questions
 
@@ -107,6 +186,7 @@ def create_quiz():
             db.session.add(question)
 
         db.session.commit()
+        invalidate_search(g.tenant_id)
 
         logging.debug(f"Quiz created successfully with ID {quiz.id}")
         return jsonify({"message": "Quiz created successfully", "quiz_id": quiz.id}), 201
@@ -118,16 +198,21 @@ def create_quiz():
 @app.route("/quizzes", methods=["GET"])
 def get_quizzes():
     try:
-        quizzes = Quizzes.query.all()
-        quizzes_list = []
+        fields, error = requested_fields(QUIZ_LIST_FIELDS)
+        if error:
+            return error
 
-        for quiz in quizzes:
-            quizzes_list.append({
-                "id": quiz.id,
-                "title": quiz.title,
-                "description": quiz.description,
-                "questions_count": len(quiz.questions)
-            })
+        query = db.session.query(Quizzes.id, Quizzes.title, Quizzes.description).order_by(Quizzes.id)
+        if "questions_count" in fields:
+            # One grouped count instead of loading every quiz's questions
+            query = query.add_columns(func.count(Questions.id).label("questions_count")) \
+                .outerjoin(Questions, Questions.quiz_id == Quizzes.id) \
+                .group_by(Quizzes.id)
+
+        quizzes_list = []
+        for row in query:
+            quiz = row._asdict()
+            quizzes_list.append({field: quiz[field] for field in QUIZ_LIST_FIELDS if field in fields})
 
         logging.debug(f"Fetched quizzes: {quizzes_list}")
         return jsonify(quizzes_list), 200
@@ -135,27 +220,58 @@ def get_quizzes():
         logging.error(f"Error fetching quizzes: {str(e)}")
         return jsonify({"message": str(e)}), 500
 
+# Search quizzes by title, description and question text
+@app.route("/quizzes/search", methods=["GET"])
+def search():
+    try:
+        q = request.args.get("q", "").strip()
+        page = request.args.get("page", 1, type=int)
+        per_page = request.args.get("per_page", 20, type=int)
+
+        if not q:
+            return jsonify({"message": "Search query 'q' is required"}), 400
+        if page < 1 or not 1 <= per_page <= MAX_PER_PAGE:
+            return jsonify({"message": f"page must be >= 1 and per_page between 1 and {MAX_PER_PAGE}"}), 400
+
+        results, total = search_quizzes(q, g.tenant_id, page=page, per_page=per_page)
+
+        logging.debug(f"Search for '{q}' matched {total} quizzes")
+        return jsonify({
+            "results": results,
+            "page": page,
+            "per_page": per_page,
+            "total": total
+        }), 200
+    except Exception as e:
+        logging.error(f"Error searching quizzes: {str(e)}")
+        return jsonify({"message": str(e)}), 500
+
 # Get details of a specific quiz (including questions)
 @app.route("/quizzes/<int:quiz_id>", methods=["GET"])
 def get_quiz_details(quiz_id):
     try:
-        quiz = Quizzes.query.get_or_404(quiz_id)
+        fields, error = requested_fields(QUIZ_DETAIL_FIELDS)
+        if error:
+            return error
 
-        questions = []
-        for question in quiz.questions:
-            questions.append({
-                "id": question.id,
-                "text": question.text,
-                "options": question.options
-            })
+        quiz = Quizzes.query.get_or_404(quiz_id)
 
         quiz_details = {
             "id": quiz.id,
             "title": quiz.title,
-            "description": quiz.description,
-            "questions": questions
+            "description": quiz.description
         }
 
+        # Only load the questions when the client asked for them
+        if "questions" in fields:
+            quiz_details["questions"] = [{
+                "id": question.id,
+                "text": question.text,
+                "options": question.options
+            } for question in quiz.questions]
+
+        quiz_details = {field: value for field, value in quiz_details.items() if field in fields}
+
         logging.debug(f"Fetched quiz details for quiz ID {quiz.id}")
         return jsonify(quiz_details), 200
     except Exception as e:
@@ -176,9 +292,14 @@ def submit_quiz(quiz_id):
         total_questions = len(quiz.questions)
 
         score = 0
+        outcomes = {}  # question ID -> answered correctly, for the adaptive estimates
         for question in quiz.questions:
-            if str(question.id) in answers and answers[str(question.id)] == question.correct_answer:
-                score += 1
+            if str(question.id) in answers:
+                outcomes[question.id] = answers[str(question.id)] == question.correct_answer
+                if outcomes[question.id]:
+                    score += 1
+
+        apply_estimates = adaptive_engine.record(quiz_id, int(user_id), outcomes)
 
         result = Results(
             quiz_id=quiz_id,
@@ -189,6 +310,8 @@ def submit_quiz(quiz_id):
 
         db.session.add(result)
         db.session.commit()
+        apply_estimates()
+        note_write(user_id)
 
         logging.debug(f"Quiz result saved for user {user_id} with score {score}")
 
@@ -201,253 +324,188 @@ def submit_quiz(quiz_id):
         logging.error(f"Error submitting quiz: {str(e)}")
         return jsonify({"message": str(e)}), 500
 
-# Get user's quiz results
-@app.route("/users/<int:user_id>/results", methods=["GET"])
-def get_user_results(user_id):
-    try:
-        results = Results.query.filter_by(user_id=user_id).all()
-        results_list = []
-
-        for result in results:
-            quiz = Quizzes.query.get(result.quiz_id)
-            results_list.append({
-                "quiz_title": quiz.title,
-                "score": result.score,
-                "total_questions": result.total_questions
-            })
-
-        logging.debug(f"Fetched results for user ID {user_id}")
-        return jsonify(results_list), 200
-    except Exception as e:
-        logging.error(f"Error fetching user results: {str(e)}")
-        return jsonify({"message": str(e)}), 500
-
-# Main entry point
-if __name__ == "__main__":
-    create_tables()  # Create tables if they don't exist
-    app.run(debug=True)
-from flask import Flask, request, jsonify
-from config import Config
-from models import db, User, Quizzes, Questions, Results
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_migrate import Migrate
-from dotenv import load_dotenv
-import logging
-
-# Load environment variables
-load_dotenv()
-
-# Initialize the Flask application
-app = Flask(__name__)
-app.config.from_object(Config)
-
-# Initialize the database and migration tools
-db.init_app(app)
-migrate = Migrate(app, db)
-
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
-
-# Create database tables if they don't exist
-def create_tables():
-    with app.app_context():
-        db.create_all()
-
-# User registration route
-@app.route("/register", methods=["POST"])
-def register():
+# Pick the next question of an adaptive quiz from the answers so far
+@app.route("/quizzes/<int:quiz_id>/adaptive/next", methods=["POST"])
+def next_adaptive_question(quiz_id):
     try:
         data = request.get_json()
-        username = data.get("username")
-        password = data.get("password")
+        user_id = data.get("user_id")
+        answers = data.get("answers") or {}
+
+        if user_id is None:
+            return jsonify({"message": "user_id is required"}), 400
+        if db.session.get(Quizzes, quiz_id) is None:
+            return jsonify({"message": "Quiz not found"}), 404
+
+        # Only the answered questions are loaded to grade them
+        answered = db.session.query(Questions.id, Questions.correct_answer).filter(
+            Questions.quiz_id == quiz_id,
+            Questions.id.in_([int(question_id) for question_id in answers])
+        )
+        outcomes = {question_id: answers[str(question_id)] == correct_answer
+                    for question_id, correct_answer in answered}
 
-        # Validate input
-        if not username or not password:
-            return jsonify({"message": "Username and password are required"}), 400
+        question_id, ability = adaptive_engine.next_question(quiz_id, int(user_id), outcomes)
 
-        # Check if the user already exists
-        if User.query.filter_by(username=username).first():
-            return jsonify({"message": "User already exists"}), 400
+        question = None
+        if question_id is not None:
+            next_question = db.session.get(Questions, question_id)
+            question = {
+                "id": next_question.id,
+                "text": next_question.text,
+                "options": next_question.options
+            }
 
-        # Create a new user
-        new_user = User(username=username, password=generate_password_hash(password))
-        db.session.add(new_user)
-        db.session.commit()
-
-        return jsonify({"message": "User registered successfully"}), 201
+        logging.debug(f"Next adaptive question for user {user_id} on quiz {quiz_id}: {question_id}")
+        return jsonify({
+            "question": question,
+            "ability": round(ability, 3),
+            "answered": len(outcomes)
+        }), 200
     except Exception as e:
-        logging.error(f"Error during registration: {str(e)}")
+        logging.error(f"Error selecting adaptive question: {str(e)}")
         return jsonify({"message": str(e)}), 500
 
-# User login route
-@app.route("/login", methods=["POST"])
-def login():
+# Stream all results of a quiz as CSV or NDJSON
+@app.route("/quizzes/<int:quiz_id>/results/export", methods=["GET"])
+def export_quiz_results(quiz_id):
     try:
-        data = request.get_json()
-        username = data.get("username")
-        password = data.get("password")
+        error = check_admin()
+        if error:
+            return error
 
-        user = User.query.filter_by(username=username).first()
+        fmt = request.args.get("format", "csv")
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({"message": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
 
-        if not user:
-            return jsonify({"message": "User not found"}), 404
+        if db.session.get(Quizzes, quiz_id) is None:
+            return jsonify({"message": "Quiz not found"}), 404
 
-        if not check_password_hash(user.password, password):
-            return jsonify({"message": "Invalid password"}), 401
-
-        return jsonify({"message": "Login successful"}), 200
+        logging.debug(f"Exporting results for quiz ID {quiz_id} as {fmt}")
+        return export_results(fmt, f"quiz_{quiz_id}_results", quiz_id=quiz_id)
     except Exception as e:
-        logging.error(f"Error during login: {str(e)}")
+        logging.error(f"Error exporting quiz results: {str(e)}")
         return jsonify({"message": str(e)}), 500
 
-# Create a new quiz
-@app.route("/quizzes", methods=["POST"])
-def create_quiz():
+# Stream the tenant's results, or every tenant's with ?all_tenants=1, as CSV or NDJSON (admin only)
+@app.route("/results/export", methods=["GET"])
+def export_all_results():
     try:
-        data = request.get_json()
-        title = data.get("title")
-        description = data.get("description")
-        questions_data = data.get("questions")
-
-        if not title or not questions_data:
-            return jsonify({"message": "Quiz title and questions are required"}), 400
-
-        # Create the quiz
-        quiz = Quizzes(title=title, description=description)
-        db.session.add(quiz)
-        db.session.flush()  # To get the quiz ID for questions
+        error = check_admin()
+        if error:
+            return error
 
-        # Create questions for the quiz
-        for question_data in questions_data:
-            text = question_data.get("text")
-            options = question_data.get("options")
-            correct_answer = question_data.get("correct_answer")
-
-            if not text or not options or not correct_answer:
-                return jsonify({"message": "Each question must have text, options, and a correct answer"}), 400
+        fmt = request.args.get("format", "csv")
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({"message": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
 
-            question = Questions(
-                quiz_id=quiz.id,
-                text=text,
-                options=options,
-                correct_answer=correct_answer
-            )
-            db.session.add(question)
+        all_tenants = request.args.get("all_tenants", "").lower() in ("1", "true", "yes")
+        tenant_id = None if all_tenants else g.tenant_id
 
-        db.session.commit()
-
-        logging.debug(f"Quiz created successfully with ID {quiz.id}")
-        return jsonify({"message": "Quiz created successfully", "quiz_id": quiz.id}), 201
+        logging.debug(f"Exporting results of {'all tenants' if all_tenants else f'tenant {tenant_id}'} as {fmt}")
+        return export_results(fmt, "results", tenant_id=tenant_id)
     except Exception as e:
-        logging.error(f"Error creating quiz: {str(e)}")
+        logging.error(f"Error exporting results: {str(e)}")
         return jsonify({"message": str(e)}), 500
 
-# Get all available quizzes
-@app.route("/quizzes", methods=["GET"])
-def get_quizzes():
+# Get user's quiz results
+@app.route("/users/<int:user_id>/results", methods=["GET"])
+def get_user_results(user_id):
     try:
-        quizzes = Quizzes.query.all()
-        quizzes_list = []
-
-        for quiz in quizzes:
-            quizzes_list.append({
-                "id": quiz.id,
-                "title": quiz.title,
-                "description": quiz.description,
-                "questions_count": len(quiz.questions)
+        # Users expect to see a result they just submitted, even if the
+        # replicas have not caught up with it yet
+        if wrote_recently(user_id):
+            use_primary()
+
+        # Older attempts live in the compressed archive, newer ones in the hot table
+        results = list(archived_results_for_user(user_id))
+        for result in Results.query.filter_by(user_id=user_id).order_by(Results.created_at):
+            results.append({
+                "quiz_id": result.quiz_id,
+                "score": result.score,
+                "total_questions": result.total_questions,
+                "created_at": result.created_at
             })
 
-        logging.debug(f"Fetched quizzes: {quizzes_list}")
-        return jsonify(quizzes_list), 200
-    except Exception as e:
-        logging.error(f"Error fetching quizzes: {str(e)}")
-        return jsonify({"message": str(e)}), 500
-
-# Get details of a specific quiz (including questions)
-@app.route("/quizzes/<int:quiz_id>", methods=["GET"])
-def get_quiz_details(quiz_id):
-    try:
-        quiz = Quizzes.query.get_or_404(quiz_id)
+        # Only the current tenant's quizzes come back, which also drops
+        # results from other tenants
+        quiz_ids = {result["quiz_id"] for result in results}
+        titles = dict(db.session.query(Quizzes.id, Quizzes.title).filter(Quizzes.id.in_(quiz_ids)))
 
-        questions = []
-        for question in quiz.questions:
-            questions.append({
-                "id": question.id,
-                "text": question.text,
-                "options": question.options
+        results_list = []
+        for result in results:
+            if result["quiz_id"] not in titles:
+                continue
+            results_list.append({
+                "quiz_title": titles.get(result["quiz_id"]),
+                "score": result["score"],
+                "total_questions": result["total_questions"],
+                "created_at": result["created_at"].isoformat()
             })
 
-        quiz_details = {
-            "id": quiz.id,
-            "title": quiz.title,
-            "description": quiz.description,
-            "questions": questions
-        }
-
-        logging.debug(f"Fetched quiz details for quiz ID {quiz.id}")
-        return jsonify(quiz_details), 200
+        logging.debug(f"Fetched results for user ID {user_id}")
+        return jsonify(results_list), 200
     except Exception as e:
-        logging.error(f"Error fetching quiz details: {str(e)}")
+        logging.error(f"Error fetching user results: {str(e)}")
         return jsonify({"message": str(e)}), 500
 
-# Submit quiz answers
-@app.route("/quizzes/<int:quiz_id>/submit", methods=["POST"])
-def submit_quiz(quiz_id):
+# Queue a background job (admin only)
+@app.route("/jobs", methods=["POST"])
+def create_job():
     try:
-        data = request.get_json()
-        logging.debug(f"Received submission data: {data}")  # Log received data
-
-        user_id = data['user_id']
-        answers = data['answers']
+        error = check_admin()
+        if error:
+            return error
 
-        quiz = Quizzes.query.get_or_404(quiz_id)
-        total_questions = len(quiz.questions)
-
-        score = 0
-        for question in quiz.questions:
-            if str(question.id) in answers and answers[str(question.id)] == question.correct_answer:
-                score += 1
-
-        result = Results(
-            quiz_id=quiz_id,
-            user_id=user_id,
-            score=score,
-            total_questions=total_questions
-        )
+        data = request.get_json()
+        kind = data.get("kind")
+        payload = data.get("payload") or {}
 
-        db.session.add(result)
-        db.session.commit()
+        if kind not in JOB_HANDLERS:
+            return jsonify({"message": f"Unknown job kind, expected one of {', '.join(sorted(JOB_HANDLERS))}"}), 400
+        if not isinstance(payload, dict):
+            return jsonify({"message": "Job payload must be an object"}), 400
 
-        logging.debug(f"Quiz result saved for user {user_id} with score {score}")
+        # Jobs run outside any request, so they are told the tenant explicitly
+        new_job = enqueue(kind, dict(payload, tenant_id=g.tenant_id))
 
-        return jsonify({
-            "message": "Quiz submitted successfully",
-            "score": score,
-            "total_questions": total_questions
-        }), 200
+        logging.debug(f"Queued {kind} job with ID {new_job.id}")
+        return jsonify({"message": "Job queued", "job_id": new_job.id}), 202
     except Exception as e:
-        logging.error(f"Error submitting quiz: {str(e)}")
+        logging.error(f"Error queueing job: {str(e)}")
         return jsonify({"message": str(e)}), 500
 
-# Get user's quiz results
-@app.route("/users/<int:user_id>/results", methods=["GET"])
-def get_user_results(user_id):
+# Get the status and progress of a background job
+@app.route("/jobs/<int:job_id>", methods=["GET"])
+def get_job(job_id):
     try:
-        results = Results.query.filter_by(user_id=user_id).all()
-        results_list = []
+        error = check_admin()
+        if error:
+            return error
 
-        for result in results:
-            quiz = Quizzes.query.get(result.quiz_id)
-            results_list.append({
-                "quiz_title": quiz.title,
-                "score": result.score,
-                "total_questions": result.total_questions
-            })
+        # Progress changes constantly, so don't serve it from a lagging replica
+        use_primary()
 
-        logging.debug(f"Fetched results for user ID {user_id}")
-        return jsonify(results_list), 200
+        # Jobs of other tenants are reported as missing, like their quizzes
+        current = db.session.get(Jobs, job_id)
+        if current is None or (current.payload or {}).get("tenant_id") != g.tenant_id:
+            return jsonify({"message": "Job not found"}), 404
+
+        return jsonify({
+            "id": current.id,
+            "kind": current.kind,
+            "status": current.status,
+            "progress": current.progress,
+            "progress_message": current.progress_message,
+            "attempts": current.attempts,
+            "max_attempts": current.max_attempts,
+            "result": current.result,
+            "error": current.error,
+            "created_at": current.created_at.isoformat(),
+            "finished_at": current.finished_at.isoformat() if current.finished_at else None
+        }), 200
     except Exception as e:
-        logging.error(f"Error fetching user results: {str(e)}")
+        logging.error(f"Error fetching job: {str(e)}")
         return jsonify({"message": str(e)}), 500
 
 # Main entry point
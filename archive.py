@@ -0,0 +1,398 @@
+import fcntl
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, select, text
+from jobs import job, report_progress
+from models import db, Results
+
+# Archived rows are spread over this many files per month by user_id, so a
+# user's history only has to open one file per archived month. Changing it
+# makes existing archives unreadable.
+ARCHIVE_BUCKETS = 64
+
+# Each bucket has an index of (user_id, offset, length) of its gzip members,
+# sorted by user_id, so a user's rows are found with a binary search instead
+# of decompressing the whole bucket
+INDEX_DTYPE = np.dtype([("user_id", "<i8"), ("offset", "<i8"), ("length", "<i8")])
+
+# First key of the advisory locks taken while archiving a month (the second
+# is the month), so they can't collide with other users of advisory locks
+ARCHIVE_LOCK_NAMESPACE = 2801
+
+# Rows fetched per round trip while archiving; progress is reported once per batch
+ARCHIVE_BATCH_SIZE = 1000
+
+ARCHIVE_FIELDS = ("id", "quiz_id", "user_id", "score", "total_questions", "created_at")
+
+results_cli = AppGroup("results", help="Manage results partitions and archives.")
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return datetime(value.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(start):
+    return f"results_{start:%Y_%m}"
+
+
+def is_partitioned():
+    if db.engine.dialect.name != "postgresql":
+        return False
+    return db.session.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('results')")
+    ).scalar() is not None
+
+
+def create_partition(begin):
+    """Create the monthly partition starting at begin; returns False if it exists.
+
+    PostgreSQL refuses to add a partition while the default partition holds
+    rows in its range (e.g. when create-partitions wasn't run in time), so
+    those rows are moved into the new partition with the default detached.
+    The caller commits.
+    """
+    name = partition_name(begin)
+    if db.session.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+        return False
+
+    bounds = {"begin": begin, "end": add_months(begin, 1)}
+    create_sql = text(
+        f"CREATE TABLE {name} PARTITION OF results "
+        f"FOR VALUES FROM ('{begin:%Y-%m-%d}') TO ('{bounds['end']:%Y-%m-%d}')"
+    )
+    has_default = db.session.execute(text("SELECT to_regclass('results_default')")).scalar()
+    if not has_default or not db.session.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM results_default WHERE created_at >= :begin AND created_at < :end)"
+    ), bounds).scalar():
+        db.session.execute(create_sql)
+        return True
+
+    logging.warning(f"Moving rows for {name} out of the default partition")
+    db.session.execute(text("ALTER TABLE results DETACH PARTITION results_default"))
+    db.session.execute(create_sql)
+    db.session.execute(text(f"""
+        INSERT INTO {name} (id, quiz_id, user_id, score, total_questions, created_at)
+        SELECT id, quiz_id, user_id, score, total_questions, created_at FROM results_default
+        WHERE created_at >= :begin AND created_at < :end
+    """), bounds)
+    db.session.execute(text("DELETE FROM results_default WHERE created_at >= :begin AND created_at < :end"), bounds)
+    db.session.execute(text("ALTER TABLE results ATTACH PARTITION results_default DEFAULT"))
+    return True
+
+
+def create_partitions(months_ahead):
+    """Make sure monthly partitions exist from this month to months_ahead out.
+
+    Meant to run on a schedule (e.g. daily from cron); months it misses are
+    caught up later by moving their rows out of the default partition.
+    """
+    start = month_start(datetime.utcnow())
+    created = []
+    for i in range(months_ahead + 1):
+        begin = add_months(start, i)
+        if create_partition(begin):
+            created.append(partition_name(begin))
+    db.session.commit()
+    return created
+
+
+def bucket_path(month_dir, user_id):
+    return os.path.join(month_dir, f"bucket_{user_id % ARCHIVE_BUCKETS:02d}.ndjson.gz")
+
+
+def index_path(bucket):
+    return bucket[:-len(".ndjson.gz")] + ".idx"
+
+
+def read_index(bucket):
+    """Memory-map a bucket's index, or return None for buckets written without one."""
+    path = index_path(bucket)
+    if not os.path.exists(path):
+        return None
+    if not os.path.getsize(path):
+        return np.empty(0, dtype=INDEX_DTYPE)
+    return np.memmap(path, dtype=INDEX_DTYPE, mode="r")
+
+
+class BucketWriter:
+    """Writes a bucket file as one gzip member per user, plus its index."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.entries = []  # (user_id, offset, length)
+
+    def write(self, user_id, lines):
+        data = gzip.compress("".join(lines).encode("utf-8"))
+        self.entries.append((user_id, self.file.tell(), len(data)))
+        self.file.write(data)
+
+    def copy(self, source):
+        """Append another bucket's members, keeping them indexed."""
+        index = read_index(source)
+        if index is None:
+            # Written before buckets were indexed, so regroup its rows by user
+            by_user = defaultdict(list)
+            with gzip.open(source, "rt", encoding="utf-8") as f:
+                for line in f:
+                    by_user[json.loads(line)["user_id"]].append(line)
+            for user_id in sorted(by_user):
+                self.write(user_id, by_user[user_id])
+            return
+
+        shift = self.file.tell()
+        with open(source, "rb") as src:
+            shutil.copyfileobj(src, self.file)
+        self.entries.extend((user_id, offset + shift, length) for user_id, offset, length in index.tolist())
+
+    def close(self):
+        self.file.close()
+        np.array(sorted(self.entries), dtype=INDEX_DTYPE).tofile(index_path(self.path))
+
+
+def merge_bucket(staged, target):
+    """Add a staged bucket file to the archive without ever exposing a partial file.
+
+    An earlier archive of the same month (e.g. late rows that landed after it
+    was archived) is kept in front. The data file is replaced before its
+    index, so an index never points past the end of its data.
+    """
+    if not os.path.exists(target):
+        os.replace(staged, target)
+        os.replace(index_path(staged), index_path(target))
+        return
+
+    merged = os.path.join(os.path.dirname(target), "." + os.path.basename(target))
+    writer = BucketWriter(merged)
+    try:
+        for source in (target, staged):
+            writer.copy(source)
+    finally:
+        writer.close()
+    os.replace(merged, target)
+    os.replace(index_path(merged), index_path(target))
+
+
+def user_lines(bucket, user_id):
+    """Yield the NDJSON lines of one bucket that may belong to user_id."""
+    index = read_index(bucket)
+    if index is None:
+        with gzip.open(bucket, "rt", encoding="utf-8") as f:
+            yield from f
+        return
+
+    # Only the user's own gzip members are read and decompressed
+    user_ids = index["user_id"]
+    first = np.searchsorted(user_ids, user_id, side="left")
+    last = np.searchsorted(user_ids, user_id, side="right")
+    with open(bucket, "rb") as f:
+        for _, offset, length in index[first:last].tolist():
+            f.seek(offset)
+            yield from gzip.decompress(f.read(length)).decode("utf-8").splitlines()
+
+
+@contextmanager
+def month_lock(begin, archive_dir):
+    """Keep other archive runs (CLI or job) away from one month while the block runs.
+
+    A lock file covers runs on this host. On PostgreSQL a transaction-level
+    advisory lock also covers workers on other hosts; it is released when the
+    block commits or rolls back.
+    """
+    lock_dir = os.path.join(archive_dir, ".locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, partition_name(begin) + ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute(
+                text("SELECT pg_advisory_xact_lock(:namespace, :month)"),
+                {"namespace": ARCHIVE_LOCK_NAMESPACE, "month": begin.year * 12 + begin.month - 1}
+            )
+        yield
+
+
+def archive_month(begin, archive_dir, progress=None):
+    """Move one month of results to gzip NDJSON files and drop it from the hot table.
+
+    progress, if given, is called with the rows archived so far after every
+    batch. Returns the number of archived rows.
+    """
+    end = add_months(begin, 1)
+    name = partition_name(begin)
+    month_dir = os.path.join(archive_dir, name)
+
+    with month_lock(begin, archive_dir):
+        # Nobody else is archiving this month, so any staging directory left
+        # behind belongs to a run that was killed
+        for leftover in glob.glob(os.path.join(archive_dir, f"{name}*.tmp")):
+            shutil.rmtree(leftover, ignore_errors=True)
+        staging_dir = tempfile.mkdtemp(prefix=f"{name}.", suffix=".tmp", dir=archive_dir)
+
+        try:
+            # yield_per streams the month through a server-side cursor in batches
+            rows = db.session.scalars(
+                select(Results)
+                .where(Results.created_at >= begin, Results.created_at < end)
+                .order_by(Results.user_id, Results.created_at)
+                .execution_options(yield_per=ARCHIVE_BATCH_SIZE)
+            )
+
+            # Rows arrive grouped by user, so each user's month becomes one
+            # gzip member of their bucket
+            writers = {}
+            user_id, lines = None, []
+
+            def flush():
+                if lines:
+                    path = bucket_path(staging_dir, user_id)
+                    if path not in writers:
+                        writers[path] = BucketWriter(path)
+                    writers[path].write(user_id, lines)
+
+            count = 0
+            try:
+                for result in rows:
+                    if result.user_id != user_id:
+                        flush()
+                        user_id, lines = result.user_id, []
+                    record = {field: getattr(result, field) for field in ARCHIVE_FIELDS}
+                    record["created_at"] = result.created_at.isoformat()
+                    lines.append(json.dumps(record) + "\n")
+                    count += 1
+                    if progress and count % ARCHIVE_BATCH_SIZE == 0:
+                        progress(count)
+                flush()
+            finally:
+                for writer in writers.values():
+                    writer.close()
+
+            if count:
+                os.makedirs(month_dir, exist_ok=True)
+                for path in glob.glob(os.path.join(staging_dir, "*.ndjson.gz")):
+                    merge_bucket(path, os.path.join(month_dir, os.path.basename(path)))
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        # Dropping a whole partition is instant and leaves no dead tuples behind.
+        # Rows of the month stranded in the default partition get a partition of
+        # their own first, so only unpartitioned tables fall back to DELETE.
+        if is_partitioned():
+            create_partition(begin)
+            db.session.execute(text(f"ALTER TABLE results DETACH PARTITION {name}"))
+            db.session.execute(text(f"DROP TABLE {name}"))
+        else:
+            Results.query.filter(Results.created_at >= begin, Results.created_at < end).delete(synchronize_session=False)
+        db.session.commit()
+
+    return count
+
+
+def archive_results(older_than_months, archive_dir, progress=None):
+    """Archive every month that ended more than older_than_months ago.
+
+    progress, if given, is called with (months done, months total, rows
+    archived so far from the month in progress) at least once per batch.
+    """
+    cutoff = add_months(month_start(datetime.utcnow()), -older_than_months)
+    oldest = db.session.query(func.min(Results.created_at)).scalar()
+    archived = {}
+    if oldest is None:
+        return archived
+
+    months = []
+    begin = month_start(oldest)
+    while begin < cutoff:
+        months.append(begin)
+        begin = add_months(begin, 1)
+
+    for done, begin in enumerate(months, start=1):
+        month_progress = (lambda rows, done=done: progress(done - 1, len(months), rows)) if progress else None
+        count = archive_month(begin, archive_dir, progress=month_progress)
+        if count:
+            archived[partition_name(begin)] = count
+        if progress:
+            progress(done, len(months), 0)
+    return archived
+
+
+def archived_results_for_user(user_id, archive_dir=None):
+    """Yield a user's archived results as dicts, oldest month first."""
+    archive_dir = archive_dir or current_app.config["RESULTS_ARCHIVE_DIR"]
+    seen = set()  # An interrupted archive run can leave rows archived twice
+    for month_dir in sorted(glob.glob(os.path.join(archive_dir, "results_*"))):
+        if month_dir.endswith(".tmp"):
+            continue  # An archive run in progress (or interrupted)
+        path = bucket_path(month_dir, user_id)
+        if not os.path.exists(path):
+            continue
+        for line in user_lines(path, user_id):
+            record = json.loads(line)
+            if record["user_id"] == user_id and record["id"] not in seen:
+                seen.add(record["id"])
+                record["created_at"] = datetime.fromisoformat(record["created_at"])
+                yield record
+
+
+@job("results_archive")
+def archive_results_job(current_job, payload):
+    """Archive old results; payload takes "older_than_months" (default 12)."""
+
+    # Reported per batch, not only per month, so a large month doesn't look
+    # like a dead worker to requeue_stale_jobs()
+    def progress(done, total, rows):
+        message = f"{done} of {total} months" + (f", {rows} rows into the next" if rows else "")
+        report_progress(current_job, 100 * done / total, message)
+
+    archived = archive_results(
+        payload.get("older_than_months", 12),
+        current_app.config["RESULTS_ARCHIVE_DIR"],
+        progress=progress
+    )
+    return {"archived": archived}
+
+
+@results_cli.command("create-partitions")
+@click.option("--months-ahead", default=3, show_default=True, help="How many future months to create.")
+def create_partitions_command(months_ahead):
+    """Create upcoming monthly partitions of the results table.
+
+    Run this regularly (e.g. a daily cron job) so rows never pile up in the
+    default partition.
+    """
+    if not is_partitioned():
+        click.echo("The results table is not partitioned on this database, nothing to do.")
+        return
+    created = create_partitions(months_ahead)
+    click.echo(f"Created partitions: {', '.join(created)}" if created else "All partitions already exist.")
+
+
+@results_cli.command("archive")
+@click.option("--older-than-months", default=12, show_default=True,
+              help="Archive months that ended more than this many months ago.")
+@click.option("--archive-dir", default=None, help="Defaults to RESULTS_ARCHIVE_DIR.")
+def archive_command(older_than_months, archive_dir):
+    """Move old results to compressed NDJSON archives."""
+    archive_dir = archive_dir or current_app.config["RESULTS_ARCHIVE_DIR"]
+    archived = archive_results(older_than_months, archive_dir)
+    for name, count in archived.items():
+        logging.info(f"Archived {count} results from {name}")
+        click.echo(f"{name}: {count} rows archived")
+    if not archived:
+        click.echo("No results old enough to archive.")
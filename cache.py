@@ -0,0 +1,43 @@
+import threading
+from collections import OrderedDict
+
+
+class NamespacedLRU:
+    """LRU cache split into independently bounded namespaces (one per tenant).
+
+    Each namespace evicts only its own entries, so a tenant with a lot of
+    churn can't push other tenants' entries out. The namespaces themselves
+    are also kept in LRU order and capped at max_namespaces.
+    """
+
+    def __init__(self, max_entries, max_namespaces=1000):
+        self.max_entries = max_entries
+        self.max_namespaces = max_namespaces
+        self._lock = threading.Lock()
+        self._namespaces = OrderedDict()
+
+    def get(self, namespace, key):
+        with self._lock:
+            entries = self._namespaces.get(namespace)
+            if entries is None or key not in entries:
+                return None
+            self._namespaces.move_to_end(namespace)
+            entries.move_to_end(key)
+            return entries[key]
+
+    def put(self, namespace, key, value):
+        with self._lock:
+            entries = self._namespaces.get(namespace)
+            if entries is None:
+                entries = self._namespaces[namespace] = OrderedDict()
+                while len(self._namespaces) > self.max_namespaces:
+                    self._namespaces.popitem(last=False)
+            self._namespaces.move_to_end(namespace)
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def clear(self, namespace):
+        with self._lock:
+            self._namespaces.pop(namespace, None)
@@ -0,0 +1,75 @@
+import gzip
+import hashlib
+from flask import g, request
+from cache import NamespacedLRU
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "text/csv", "text/plain", "text/html")
+
+
+def choose_encoding():
+    """Pick the best encoding the client accepts, or None."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding, level):
+    if encoding == "br":
+        return brotli.compress(body, quality=level["br"])
+    return gzip.compress(body, compresslevel=level["gzip"], mtime=0)
+
+
+class Compression:
+    """Negotiated gzip/brotli compression of buffered responses."""
+
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_size = app.config["COMPRESS_MIN_SIZE"]
+        self.level = {"gzip": app.config["COMPRESS_GZIP_LEVEL"], "br": app.config["COMPRESS_BROTLI_QUALITY"]}
+        # Compressed bodies keyed by a digest of the raw body, so repeated
+        # catalog and quiz payloads are only compressed once per encoding
+        self.cache = NamespacedLRU(
+            app.config["COMPRESS_CACHE_SIZE"], max_namespaces=app.config["COMPRESS_CACHE_TENANTS"]
+        )
+        app.after_request(self.after_request)
+
+    def after_request(self, response):
+        # Streamed responses (exports) are passed through untouched
+        if response.is_streamed or response.direct_passthrough:
+            return response
+        if response.status_code != 200 or "Content-Encoding" in response.headers:
+            return response
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        if response.content_length is not None and response.content_length < self.min_size:
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding()
+        if encoding is None:
+            return response
+
+        body = response.get_data()
+        # Cached per tenant so one tenant's churn doesn't evict everyone else
+        namespace = g.get("tenant_id")
+        key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        compressed = self.cache.get(namespace, key)
+        if compressed is None:
+            compressed = compress(body, encoding, self.level)
+            self.cache.put(namespace, key, compressed)
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        return response
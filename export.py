@@ -0,0 +1,116 @@
+import csv
+import io
+import json
+import logging
+import os
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import func, select
+from jobs import job, report_progress
+from models import db, Quizzes, Results
+
+EXPORT_COLUMNS = (
+    Results.id,
+    Results.quiz_id,
+    Results.user_id,
+    Results.score,
+    Results.total_questions,
+    Results.created_at,
+)
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# Rows fetched per round trip from the server-side cursor and rows written per
+# response chunk; memory use depends on these, not on the number of results
+BATCH_SIZE = 1000
+
+
+def results_statement(quiz_id=None, tenant_id=None):
+    statement = select(*EXPORT_COLUMNS).order_by(Results.created_at, Results.id)
+    if quiz_id is not None:
+        statement = statement.where(Results.quiz_id == quiz_id)
+    if tenant_id is not None:
+        statement = statement.where(Results.quiz_id.in_(select(Quizzes.id).where(Quizzes.tenant_id == tenant_id)))
+    return statement.execution_options(yield_per=BATCH_SIZE)
+
+
+def csv_header():
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow([column.key for column in EXPORT_COLUMNS])
+    return buffer.getvalue()
+
+
+def csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for batch in rows.partitions():
+        for row in batch:
+            writer.writerow([value.isoformat() if hasattr(value, "isoformat") else value for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def ndjson_chunks(rows):
+    keys = [column.key for column in EXPORT_COLUMNS]
+    for batch in rows.partitions():
+        lines = []
+        for row in batch:
+            record = dict(zip(keys, row))
+            record["created_at"] = record["created_at"].isoformat()
+            lines.append(json.dumps(record))
+        yield "\n".join(lines) + "\n"
+
+
+def export_results(fmt, filename, quiz_id=None, tenant_id=None):
+    """Build a streaming response with the matching results as CSV or NDJSON."""
+
+    def generate():
+        try:
+            # Send the header before the query runs so clients get bytes at once
+            if fmt == "csv":
+                yield csv_header()
+            rows = db.session.execute(results_statement(quiz_id, tenant_id))
+            yield from csv_chunks(rows) if fmt == "csv" else ndjson_chunks(rows)
+        except Exception as e:
+            # Headers are already sent, so all we can do is cut the stream short
+            logging.error(f"Error streaming results export: {str(e)}")
+            raise
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{fmt}"}
+    )
+
+
+@job("results_export")
+def export_results_job(current_job, payload):
+    """Write an export to EXPORT_DIR; payload takes "format" and optionally "quiz_id" and "tenant_id"."""
+    fmt = payload.get("format", "csv")
+    quiz_id = payload.get("quiz_id")
+    tenant_id = payload.get("tenant_id")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+
+    statement = results_statement(quiz_id, tenant_id)
+    total = db.session.scalar(select(func.count()).select_from(statement.order_by(None).subquery()))
+
+    export_dir = current_app.config["EXPORT_DIR"]
+    os.makedirs(export_dir, exist_ok=True)
+    path = os.path.join(export_dir, f"job_{current_job.id}_results.{fmt}")
+
+    written = 0
+    with open(path + ".tmp", "w", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            f.write(csv_header())
+        rows = db.session.execute(statement)
+        for chunk in csv_chunks(rows) if fmt == "csv" else ndjson_chunks(rows):
+            f.write(chunk)
+            written = min(written + BATCH_SIZE, total)
+            report_progress(current_job, 100 * written / max(total, 1), f"{written} of {total} rows")
+    os.replace(path + ".tmp", path)
+
+    return {"path": path, "rows": total}
@@ -0,0 +1,244 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, select, update
+from models import db, Jobs
+
+# kind -> handler(job, payload); handlers return a JSON-serializable result
+JOB_HANDLERS = {}
+
+jobs_cli = AppGroup("jobs", help="Run and manage background jobs.")
+
+# How often a running worker looks for jobs abandoned by dead workers
+REQUEUE_INTERVAL = 60
+
+
+def enable_sqlite_wal(app, db):
+    """Switch SQLite databases to WAL so job progress can be written while a
+    handler still has a read cursor open on another connection."""
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", _enable_sqlite_wal)
+
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def job(kind):
+    """Register a function as the handler for jobs of the given kind."""
+    def decorator(handler):
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return decorator
+
+
+def enqueue(kind, payload=None, max_attempts=None):
+    new_job = Jobs(
+        kind=kind,
+        payload=payload or {},
+        max_attempts=max_attempts or current_app.config["JOBS_MAX_ATTEMPTS"]
+    )
+    db.session.add(new_job)
+    db.session.commit()
+    return new_job
+
+
+def report_progress(job, percent, message=None):
+    """Store a job's progress in its own transaction, leaving the handler's session alone."""
+    with db.engine.begin() as connection:
+        connection.execute(
+            update(Jobs).where(Jobs.id == job.id).values(
+                progress=max(0, min(100, int(percent))),
+                progress_message=message,
+                updated_at=datetime.utcnow()
+            )
+        )
+
+
+def claim_next_job():
+    """Atomically move the next due job from queued to running and return its id.
+
+    The conditional UPDATE lets several workers poll the same table (on
+    PostgreSQL or SQLite) without handing the same job out twice.
+    """
+    now = datetime.utcnow()
+    candidates = db.session.scalars(
+        select(Jobs.id)
+        .where(Jobs.status == "queued", Jobs.run_at <= now)
+        .order_by(Jobs.run_at, Jobs.id)
+        .limit(10)
+    ).all()
+
+    for job_id in candidates:
+        claimed = db.session.execute(
+            update(Jobs)
+            .where(Jobs.id == job_id, Jobs.status == "queued")
+            .values(status="running", attempts=Jobs.attempts + 1, started_at=now, updated_at=now)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+
+    db.session.commit()
+    return None
+
+
+def requeue_stale_jobs(stale_after):
+    """Put back jobs left running by a worker that died; returns (requeued, failed).
+
+    Jobs that have used up their attempts are marked failed instead, so a job
+    that kills its worker every time isn't retried forever.
+    """
+    now = datetime.utcnow()
+    stale = (Jobs.status == "running", Jobs.updated_at < now - timedelta(seconds=stale_after))
+    failed = db.session.execute(
+        update(Jobs)
+        .where(*stale, Jobs.attempts >= Jobs.max_attempts)
+        .values(status="failed", error="Worker stopped responding", finished_at=now, updated_at=now)
+    ).rowcount
+    requeued = db.session.execute(
+        update(Jobs)
+        .where(*stale, Jobs.attempts < Jobs.max_attempts)
+        .values(status="queued", run_at=now)
+    ).rowcount
+    db.session.commit()
+    return requeued, failed
+
+
+def _get_app():
+    # Imported lazily so process pool workers build their own app
+    from app import app
+    return app
+
+
+def _init_process():
+    # Connections inherited from the parent process must not be reused
+    app = _get_app()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def run_job(job_id):
+    """Run one claimed job inside its own app context, handling retries."""
+    app = _get_app()
+    with app.app_context():
+        current = db.session.get(Jobs, job_id)
+        handler = JOB_HANDLERS.get(current.kind)
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for job kind '{current.kind}'")
+            result = handler(current, current.payload or {})
+
+            current.status = "done"
+            current.progress = 100
+            current.result = result
+            current.error = None
+            current.finished_at = datetime.utcnow()
+            db.session.commit()
+            logging.info(f"Job {job_id} ({current.kind}) finished")
+        except Exception as e:
+            db.session.rollback()
+            current = db.session.get(Jobs, job_id)
+            current.error = str(e)
+            if handler is not None and current.attempts < current.max_attempts:
+                # Exponential backoff: base, 2 * base, 4 * base, ...
+                delay = app.config["JOBS_RETRY_BACKOFF"] * 2 ** (current.attempts - 1)
+                current.status = "queued"
+                current.run_at = datetime.utcnow() + timedelta(seconds=delay)
+                logging.warning(f"Job {job_id} ({current.kind}) failed, retrying in {delay}s: {str(e)}")
+            else:
+                current.status = "failed"
+                current.finished_at = datetime.utcnow()
+                logging.error(f"Job {job_id} ({current.kind}) failed: {str(e)}")
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+
+class Worker:
+    """Polls the jobs table and runs claimed jobs on a thread or process pool."""
+
+    def __init__(self, concurrency, mode, poll_interval, stale_after=3600):
+        self.concurrency = concurrency
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._requeued_at = float("-inf")
+
+    def make_executor(self):
+        if self.mode == "process":
+            return ProcessPoolExecutor(max_workers=self.concurrency, initializer=_init_process)
+        return ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job")
+
+    def requeue_stale(self):
+        """Requeue abandoned jobs, at most once per REQUEUE_INTERVAL."""
+        if time.monotonic() - self._requeued_at < REQUEUE_INTERVAL:
+            return
+        self._requeued_at = time.monotonic()
+        requeued, failed = requeue_stale_jobs(self.stale_after)
+        if requeued:
+            logging.warning(f"Requeued {requeued} stale jobs")
+        if failed:
+            logging.error(f"Failed {failed} stale jobs that were out of attempts")
+
+    def poll(self, executor, running):
+        """Claim due jobs until the pool is full; returns False if the database failed."""
+        try:
+            self.requeue_stale()
+            while len(running) < self.concurrency:
+                job_id = claim_next_job()
+                if job_id is None:
+                    break
+                logging.debug(f"Claimed job {job_id}")
+                running.add(executor.submit(run_job, job_id))
+            return True
+        except Exception as e:
+            # A transient database error must not take the worker down with
+            # its running jobs; try again on the next poll
+            logging.error(f"Error polling for jobs: {str(e)}")
+            db.session.rollback()
+            return False
+
+    def run(self, burst=False):
+        running = set()
+        with self.make_executor() as executor:
+            while True:
+                polled = self.poll(executor, running)
+
+                if burst and polled and not running:
+                    return
+
+                if len(running) >= self.concurrency:
+                    _, running = wait(running, return_when=FIRST_COMPLETED)
+                else:
+                    # Nothing due right now; wake up early if a job completes
+                    _, running = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    if not running:
+                        time.sleep(self.poll_interval)
+
+
+@jobs_cli.command("worker")
+@click.option("--concurrency", type=int, default=None, help="Defaults to JOBS_CONCURRENCY.")
+@click.option("--mode", type=click.Choice(["thread", "process"]), default=None, help="Defaults to JOBS_POOL.")
+@click.option("--poll-interval", type=float, default=None, help="Defaults to JOBS_POLL_INTERVAL.")
+@click.option("--burst", is_flag=True, help="Exit once the queue is empty.")
+def worker_command(concurrency, mode, poll_interval, burst):
+    """Run queued jobs until interrupted."""
+    config = current_app.config
+    worker = Worker(
+        concurrency=concurrency or config["JOBS_CONCURRENCY"],
+        mode=mode or config["JOBS_POOL"],
+        poll_interval=poll_interval or config["JOBS_POLL_INTERVAL"],
+        stale_after=config["JOBS_STALE_AFTER"]
+    )
+    click.echo(f"Starting {worker.mode} worker with concurrency {worker.concurrency}")
+    worker.run(burst=burst)
@@ -0,0 +1,50 @@
+"""Add full-text search to quizzes and questions
+
+Revision ID: 5b7e1c9a4d20
+Revises: 2dd4ee1f128a
+Create Date: 2026-10-19 09:12:41.508113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e1c9a4d20'
+down_revision = '2dd4ee1f128a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # tsvector columns and GIN indexes only exist on PostgreSQL; other
+    # databases fall back to the in-memory trigram index in search.py
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    # Generated columns keep the vectors in sync without any app-side code
+    op.execute("""
+        ALTER TABLE quizzes ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'B')
+        ) STORED
+    """)
+    op.execute("""
+        ALTER TABLE questions ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(text, '')), 'C')
+        ) STORED
+    """)
+    op.create_index('ix_quizzes_search_vector', 'quizzes', ['search_vector'], postgresql_using='gin')
+    op.create_index('ix_questions_search_vector', 'questions', ['search_vector'], postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_questions_search_vector', table_name='questions')
+    op.drop_index('ix_quizzes_search_vector', table_name='quizzes')
+    op.drop_column('questions', 'search_vector')
+    op.drop_column('quizzes', 'search_vector')
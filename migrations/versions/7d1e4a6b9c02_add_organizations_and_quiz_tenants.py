@@ -0,0 +1,58 @@
+"""Add organizations and quiz tenants
+
+Revision ID: 7d1e4a6b9c02
+Revises: 3a6c9f2b8e57
+Create Date: 2026-10-19 21:18:46.902355
+
+"""
+from alembic import op
+from flask import current_app
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d1e4a6b9c02'
+down_revision = '3a6c9f2b8e57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    organizations = op.create_table('organizations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=80), nullable=False),
+    sa.Column('slug', sa.String(length=80), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name'),
+    sa.UniqueConstraint('slug')
+    )
+
+    # Existing quizzes move to the default organization (DEFAULT_TENANT)
+    slug = current_app.config['DEFAULT_TENANT']
+    op.bulk_insert(organizations, [{'id': 1, 'name': slug.replace('-', ' ').title(), 'slug': slug}])
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("SELECT setval('organizations_id_seq', 1)")
+
+    with op.batch_alter_table('quizzes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), nullable=True))
+    op.execute("UPDATE quizzes SET tenant_id = 1")
+    with op.batch_alter_table('quizzes', schema=None) as batch_op:
+        batch_op.alter_column('tenant_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('quizzes_tenant_id_fkey', 'organizations', ['tenant_id'], ['id'])
+        batch_op.create_index('ix_quizzes_tenant_id_id', ['tenant_id', 'id'], unique=False)
+
+    with op.batch_alter_table('questions', schema=None) as batch_op:
+        batch_op.create_index('ix_questions_quiz_id', ['quiz_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('questions', schema=None) as batch_op:
+        batch_op.drop_index('ix_questions_quiz_id')
+
+    with op.batch_alter_table('quizzes', schema=None) as batch_op:
+        batch_op.drop_index('ix_quizzes_tenant_id_id')
+        batch_op.drop_constraint('quizzes_tenant_id_fkey', type_='foreignkey')
+        batch_op.drop_column('tenant_id')
+
+    op.drop_table('organizations')
@@ -0,0 +1,24 @@
+"""Index results by quiz for exports
+
+Revision ID: 9e2a7d5f31c8
+Revises: c41f08d2e6b3
+Create Date: 2026-10-19 14:03:52.880417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e2a7d5f31c8'
+down_revision = 'c41f08d2e6b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_results_quiz_id_created_at', 'results', ['quiz_id', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_results_quiz_id_created_at', table_name='results')
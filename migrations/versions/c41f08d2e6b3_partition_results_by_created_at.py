@@ -0,0 +1,101 @@
+"""Partition results by created_at
+
+Revision ID: c41f08d2e6b3
+Revises: 5b7e1c9a4d20
+Create Date: 2026-10-19 11:40:07.215930
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f08d2e6b3'
+down_revision = '5b7e1c9a4d20'
+branch_labels = None
+depends_on = None
+
+# Monthly partitions created up front; later ones come from
+# `flask results create-partitions`
+MONTHS_AHEAD = 3
+
+
+def _month(offset):
+    now = datetime.utcnow()
+    month = now.month - 1 + offset
+    return datetime(now.year + month // 12, month % 12 + 1, 1)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('results', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=False,
+                                          server_default=sa.func.current_timestamp()))
+            batch_op.create_index('ix_results_user_id_created_at', ['user_id', 'created_at'])
+        return
+
+    # A partitioned table can't be created from an existing one, so rebuild
+    # results and copy the rows over. Existing rows get the migration time.
+    op.execute("ALTER TABLE results RENAME TO results_unpartitioned")
+    op.execute("ALTER TABLE results_unpartitioned RENAME CONSTRAINT results_pkey TO results_unpartitioned_pkey")
+    op.execute("ALTER SEQUENCE results_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE results_unpartitioned ALTER COLUMN id DROP DEFAULT")
+
+    # The partition key has to be part of the primary key
+    op.execute("""
+        CREATE TABLE results (
+            id INTEGER NOT NULL DEFAULT nextval('results_id_seq'),
+            quiz_id INTEGER NOT NULL REFERENCES quizzes (id),
+            user_id INTEGER NOT NULL REFERENCES "user" (id),
+            score INTEGER,
+            total_questions INTEGER NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() at time zone 'utc'),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("ALTER SEQUENCE results_id_seq OWNED BY results.id")
+    op.execute("CREATE TABLE results_default PARTITION OF results DEFAULT")
+    for i in range(MONTHS_AHEAD + 1):
+        begin, end = _month(i), _month(i + 1)
+        op.execute(
+            f"CREATE TABLE results_{begin:%Y_%m} PARTITION OF results "
+            f"FOR VALUES FROM ('{begin:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        )
+    op.create_index('ix_results_user_id_created_at', 'results', ['user_id', 'created_at'])
+
+    op.execute("""
+        INSERT INTO results (id, quiz_id, user_id, score, total_questions)
+        SELECT id, quiz_id, user_id, score, total_questions FROM results_unpartitioned
+    """)
+    op.drop_table('results_unpartitioned')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('results', schema=None) as batch_op:
+            batch_op.drop_index('ix_results_user_id_created_at')
+            batch_op.drop_column('created_at')
+        return
+
+    # Archived rows are not brought back; only the hot table is restored
+    op.execute("ALTER TABLE results RENAME TO results_partitioned")
+    op.execute("ALTER TABLE results_partitioned RENAME CONSTRAINT results_pkey TO results_partitioned_pkey")
+    op.execute("ALTER SEQUENCE results_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE results_partitioned ALTER COLUMN id DROP DEFAULT")
+    op.execute("""
+        CREATE TABLE results (
+            id INTEGER NOT NULL DEFAULT nextval('results_id_seq'),
+            quiz_id INTEGER NOT NULL REFERENCES quizzes (id),
+            user_id INTEGER NOT NULL REFERENCES "user" (id),
+            score INTEGER,
+            total_questions INTEGER NOT NULL,
+            CONSTRAINT results_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute("ALTER SEQUENCE results_id_seq OWNED BY results.id")
+    op.execute("""
+        INSERT INTO results (id, quiz_id, user_id, score, total_questions)
+        SELECT id, quiz_id, user_id, score, total_questions FROM results_partitioned
+    """)
+    op.execute("DROP TABLE results_partitioned CASCADE")
@@ -1,7 +1,15 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+class Organizations(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), unique=True, nullable=False)
+    slug = db.Column(db.String(80), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    quizzes = db.relationship('Quizzes', backref='tenant', lazy=True)
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -16,17 +24,63 @@ class Quizzes(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     questions = db.relationship('Questions', backref='quiz', lazy=True)
     description = db.Column(db.String(255), nullable=True)
+    # Owning organization; queries are scoped to it automatically (see tenants.py)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('organizations.id'), nullable=False)
+    # search_vector (tsvector) is a generated column that only exists on
+    # PostgreSQL, so it is left unmapped and only referenced from search.py
+
+    __table_args__ = (
+        db.Index('ix_quizzes_tenant_id_id', 'tenant_id', 'id'),
+    )
 
 class Questions(db.Model):
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'))
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), index=True)
     id = db.Column(db.Integer, primary_key=True)
     options = db.Column(db.String(80), nullable=False)
     correct_answer = db.Column(db.String(80), nullable=False)
     text = db.Column(db.String(80), nullable=False)  # Correct field name
+    # Also has an unmapped search_vector column on PostgreSQL, see search.py
+    # Adaptive quiz estimates (see adaptive.py)
+    difficulty = db.Column(db.Float, nullable=False, default=0)
+    responses = db.Column(db.Integer, nullable=False, default=0)
 
 class Results(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)   
     score = db.Column(db.Integer)
-    total_questions = db.Column(db.Integer, nullable=False)
\ No newline at end of file
+    total_questions = db.Column(db.Integer, nullable=False)
+    # Partition key on PostgreSQL, where the primary key is (id, created_at)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_results_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_results_quiz_id_created_at', 'quiz_id', 'created_at'),
+    )
+
+class UserAbilities(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), primary_key=True)
+    ability = db.Column(db.Float, nullable=False, default=0)
+    responses = db.Column(db.Integer, nullable=False, default=0)
+
+class Jobs(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(80), nullable=False)
+    payload = db.Column(db.JSON, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    progress = db.Column(db.Integer, nullable=False, default=0)  # Percent
+    progress_message = db.Column(db.String(255), nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
@@ -0,0 +1,145 @@
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+from datetime import datetime
+from flask import abort, current_app, has_request_context, jsonify, request
+from sqlalchemy import event
+
+# How each dialect is asked for a plan. EXPLAIN ANALYZE runs the statement
+# again, so it is only ever used for read-only statements.
+EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN (ANALYZE, BUFFERS) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+READ_ONLY_STATEMENT = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+# Selects that write or lock anyway: data-modifying CTEs, row locks
+# (FOR [NO KEY] UPDATE, FOR [KEY] SHARE) and sequence calls
+SIDE_EFFECTS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|FOR\s+(KEY\s+)?SHARE|NEXTVAL|SETVAL)\b", re.IGNORECASE
+)
+
+
+class QueryProfiler:
+    """Times every SQL statement and keeps the slowest ones in memory.
+
+    Statements slower than the explain threshold are logged and get their
+    query plan captured. Nothing is hooked up unless init_app() is called,
+    so a disabled profiler costs nothing.
+    """
+
+    def __init__(self, size=50, explain_threshold_ms=200):
+        self.size = size
+        self.explain_threshold = explain_threshold_ms / 1000
+        self._lock = threading.Lock()
+        self._slowest = []  # Min-heap of (duration, sequence, entry)
+        self._sequence = itertools.count()
+
+    def init_app(self, app, db):
+        self.size = app.config["SQL_PROFILING_BUFFER_SIZE"]
+        if self.size < 1:
+            raise ValueError("SQL_PROFILING_BUFFER_SIZE must be at least 1")
+        self.explain_threshold = app.config["SQL_PROFILING_EXPLAIN_MS"] / 1000
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+                event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+                event.listen(engine, "handle_error", self.handle_error)
+        app.add_url_rule("/_profile", "profile", self.profile_view, methods=["GET", "DELETE"])
+
+    # Start times are keyed by cursor, so nested statements on one connection
+    # don't mix, and dropped by handle_error when a statement fails
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profiling_started", {})[id(cursor)] = time.perf_counter()
+
+    def handle_error(self, exception_context):
+        context = exception_context.execution_context
+        if exception_context.connection is not None and context is not None:
+            exception_context.connection.info.get("profiling_started", {}).pop(id(context.cursor), None)
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("profiling_started", {}).pop(id(cursor), None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+
+        # Most statements are neither slow nor among the slowest seen so far.
+        # Checked without the lock: reset() swaps the list instead of emptying
+        # it and a full heap never shrinks, so the local reference stays valid.
+        slow = duration >= self.explain_threshold
+        slowest = self._slowest
+        if not slow and slowest and len(slowest) >= self.size and duration <= slowest[0][0]:
+            return
+
+        endpoint = request.endpoint if has_request_context() else None
+        entry = {
+            "statement": statement,
+            "duration_ms": round(duration * 1000, 3),
+            "endpoint": endpoint,
+            "database": conn.dialect.name,
+            "recorded_at": datetime.utcnow().isoformat(),
+            "plan": None
+        }
+        if slow:
+            logging.warning(f"Slow query ({entry['duration_ms']} ms) in {endpoint}: {statement}")
+            if not executemany:
+                entry["plan"] = self.explain(conn, statement, parameters)
+
+        with self._lock:
+            item = (duration, next(self._sequence), entry)
+            if len(self._slowest) < self.size:
+                heapq.heappush(self._slowest, item)
+            elif duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def explain(self, conn, statement, parameters):
+        prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+        if prefix is None or not READ_ONLY_STATEMENT.match(statement) or SIDE_EFFECTS.search(statement):
+            return None
+
+        # Use a raw DBAPI cursor so the EXPLAIN isn't profiled itself, inside
+        # a savepoint so a failing EXPLAIN can't abort the caller's transaction
+        cursor = conn.connection.cursor()
+        savepoint = conn.dialect.name == "postgresql"
+        try:
+            if savepoint:
+                cursor.execute("SAVEPOINT profiling_explain")
+            cursor.execute(prefix + statement, parameters)
+            plan = "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT profiling_explain")
+            return plan
+        except Exception as e:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT profiling_explain")
+            return f"EXPLAIN failed: {str(e)}"
+        finally:
+            cursor.close()
+
+    def slowest(self):
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._slowest, reverse=True)]
+
+    def reset(self):
+        with self._lock:
+            self._slowest = []
+
+    def profile_view(self):
+        # The buffer holds raw SQL, so it is never served outside debug mode
+        if not current_app.debug:
+            abort(404)
+
+        if request.method == "DELETE":
+            self.reset()
+            return jsonify({"message": "Profile cleared"}), 200
+
+        return jsonify({
+            "explain_threshold_ms": self.explain_threshold * 1000,
+            "statements": self.slowest()
+        }), 200
+
+
+profiler = QueryProfiler()
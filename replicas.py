@@ -0,0 +1,157 @@
+import itertools
+import logging
+import threading
+import time
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+
+# Replica engines are registered as SQLALCHEMY_BINDS with this key prefix
+REPLICA_BIND_PREFIX = "replica_"
+
+READ_METHODS = ("GET", "HEAD")
+
+# Replay lag in seconds. A replica that is streaming and has replayed
+# everything it received is up to date (an idle primary is not lag). One that
+# lost the primary replays what it has and stops, so without a streaming WAL
+# receiver the time since the last replayed transaction counts, and a replica
+# that never replayed anything is treated as infinitely behind. Reading
+# pg_stat_wal_receiver.status needs the pg_read_all_stats role; without it
+# every replica is judged by the timestamp alone.
+POSTGRES_LAG_SQL = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+             AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8, 'Infinity')
+    END
+""")
+
+
+class ReplicaRouter:
+    """Round-robin selection of healthy read replicas.
+
+    Replicas are health checked (connectivity and, on PostgreSQL, replay lag)
+    at most once per REPLICA_HEALTH_CHECK_INTERVAL. A replica that fails a
+    check or drops a connection is skipped until the next interval, so reads
+    fall back to the other replicas or the primary.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._checked_at = {}
+        self._unhealthy_until = {}
+
+    def init_app(self, app, db):
+        with app.app_context():
+            for key, engine in db.engines.items():
+                if key and key.startswith(REPLICA_BIND_PREFIX):
+                    event.listen(engine, "handle_error", self._error_handler(key))
+
+    def _error_handler(self, key):
+        def handle_error(context):
+            if context.is_disconnect:
+                logging.warning(f"Lost connection to {key}, routing reads elsewhere")
+                self.mark_unhealthy(key)
+        return handle_error
+
+    def mark_unhealthy(self, key):
+        interval = current_app.config["REPLICA_HEALTH_CHECK_INTERVAL"]
+        with self._lock:
+            self._unhealthy_until[key] = time.monotonic() + interval
+
+    def pick(self, engines):
+        """Return the bind key of the next healthy replica, or None for the primary."""
+        keys = sorted(key for key in engines if key and key.startswith(REPLICA_BIND_PREFIX))
+        if not keys:
+            return None
+
+        start = next(self._counter)
+        for i in range(len(keys)):
+            key = keys[(start + i) % len(keys)]
+            if self._is_healthy(key, engines[key]):
+                return key
+        return None
+
+    def _is_healthy(self, key, engine):
+        interval = current_app.config["REPLICA_HEALTH_CHECK_INTERVAL"]
+        now = time.monotonic()
+
+        with self._lock:
+            if self._unhealthy_until.get(key, 0) > now:
+                return False
+            # Only one thread runs the check for a replica per interval
+            due = now - self._checked_at.get(key, float("-inf")) >= interval
+            if due:
+                self._checked_at[key] = now
+
+        if due and not self._check(key, engine):
+            self.mark_unhealthy(key)
+            return False
+        return True
+
+    def _check(self, key, engine):
+        max_lag = current_app.config["REPLICA_MAX_LAG_SECONDS"]
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == "postgresql":
+                    lag = connection.execute(POSTGRES_LAG_SQL).scalar() or 0
+                    if lag > max_lag:
+                        logging.warning(f"Replica {key} is {lag:.1f}s behind, routing reads to the primary")
+                        return False
+                else:
+                    connection.execute(text("SELECT 1"))
+            return True
+        except Exception as e:
+            logging.warning(f"Replica {key} failed its health check: {str(e)}")
+            return False
+
+
+replica_router = ReplicaRouter()
+
+
+def use_primary():
+    """Pin the rest of the current request's reads to the primary."""
+    g.use_primary = True
+
+
+# Read-after-write state travels with the client in the signed session
+# cookie, so it holds whichever worker process serves the follow-up read
+RECENT_WRITES_KEY = "primary_reads_until"
+
+
+def note_write(user_id):
+    """Keep user_id's reads on the primary for REPLICA_READ_AFTER_WRITE_SECONDS."""
+    now = time.time()
+    until = now + current_app.config["REPLICA_READ_AFTER_WRITE_SECONDS"]
+    recent = {key: expires for key, expires in session.get(RECENT_WRITES_KEY, {}).items() if expires > now}
+    recent[str(user_id)] = until
+    session[RECENT_WRITES_KEY] = recent
+
+
+def wrote_recently(user_id):
+    return session.get(RECENT_WRITES_KEY, {}).get(str(user_id), 0) > time.time()
+
+
+class RoutingSession(Session):
+    """Session that sends reads from GET/HEAD requests to a read replica.
+
+    Flushes, sessions with pending changes and anything outside a read-only
+    request always use the primary. A request sticks to the replica picked
+    for its first query so it reads a consistent snapshot.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._reads_from_replica():
+            if "replica_bind" not in g:
+                g.replica_bind = replica_router.pick(self._db.engines)
+            if g.replica_bind is not None:
+                return self._db.engines[g.replica_bind]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _reads_from_replica(self):
+        if not has_request_context() or request.method not in READ_METHODS:
+            return False
+        if g.get("use_primary") or self._flushing:
+            return False
+        return not (self.new or self.dirty or self.deleted)
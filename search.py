@@ -0,0 +1,182 @@
+import re
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import text
+from cache import NamespacedLRU
+from models import db, Quizzes, Questions
+
+# Field weights used when ranking matches; quiz titles count the most,
+# question text the least (mirrors the A/B/C weights of the tsvector columns)
+TITLE_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+QUESTION_WEIGHT = 0.2
+
+# Minimum trigram word similarity for the SQLite fallback (same default as
+# pg_trgm.word_similarity_threshold)
+TRIGRAM_THRESHOLD = 0.6
+
+# Most tenants whose trigram index is kept in memory at once
+TRIGRAM_MAX_TENANTS = 100
+
+# Indexes are rebuilt after this many seconds to pick up quizzes created by
+# other processes, which can't invalidate this one
+TRIGRAM_INDEX_TTL = 300
+
+# Matches against the generated tsvector columns (see the "add full-text
+# search" migration). Quiz and question matches are merged so a quiz is
+# returned once, with its best weighted rank.
+POSTGRES_MATCHES_CTE = """
+    WITH query AS (
+        SELECT websearch_to_tsquery('english', :q) AS tsq
+    ),
+    matches AS (
+        SELECT quizzes.id AS quiz_id, ts_rank(quizzes.search_vector, query.tsq) AS rank
+        FROM quizzes, query
+        WHERE quizzes.search_vector @@ query.tsq AND quizzes.tenant_id = :tenant_id
+        UNION ALL
+        SELECT questions.quiz_id, ts_rank(questions.search_vector, query.tsq) AS rank
+        FROM questions
+        JOIN quizzes ON quizzes.id = questions.quiz_id, query
+        WHERE questions.search_vector @@ query.tsq AND quizzes.tenant_id = :tenant_id
+    )
+"""
+
+POSTGRES_SEARCH_SQL = text(POSTGRES_MATCHES_CTE + """
+    SELECT quizzes.id, quizzes.title, quizzes.description, max(matches.rank) AS rank
+    FROM matches
+    JOIN quizzes ON quizzes.id = matches.quiz_id
+    GROUP BY quizzes.id, quizzes.title, quizzes.description
+    ORDER BY rank DESC, quizzes.id
+    LIMIT :limit OFFSET :offset
+""")
+
+POSTGRES_COUNT_SQL = text(POSTGRES_MATCHES_CTE + """
+    SELECT count(DISTINCT quiz_id) FROM matches
+""")
+
+
+def trigrams(value):
+    """Split a string into the padded, lower-cased trigrams pg_trgm would use."""
+    grams = set()
+    for word in re.findall(r"\w+", (value or "").lower()):
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+class TrigramIndex:
+    """In-memory trigram index of one tenant's quizzes, used when the database
+    has no full-text support.
+
+    The index is built lazily from the quizzes and questions tables on the
+    first search, thrown away by invalidate_search() whenever the tenant's
+    quizzes change in this process and rebuilt after TRIGRAM_INDEX_TTL.
+    """
+
+    def __init__(self, tenant_id):
+        self.tenant_id = tenant_id
+        self._lock = threading.Lock()
+        self._postings = None
+        self._quizzes = None
+        self._built_at = None
+
+    def _build(self):
+        postings = defaultdict(list)  # trigram -> [(quiz_id, field_id)]
+        quizzes = {}
+
+        def add(quiz_id, field_id, value):
+            for gram in trigrams(value):
+                postings[gram].append((quiz_id, field_id))
+
+        for quiz_id, title, description in db.session.query(
+                Quizzes.id, Quizzes.title, Quizzes.description).filter(Quizzes.tenant_id == self.tenant_id):
+            quizzes[quiz_id] = {"id": quiz_id, "title": title, "description": description}
+            add(quiz_id, ("title", quiz_id), title)
+            add(quiz_id, ("description", quiz_id), description)
+
+        for question_id, quiz_id, question_text in db.session.query(
+                Questions.id, Questions.quiz_id, Questions.text).join(Quizzes).filter(
+                Quizzes.tenant_id == self.tenant_id):
+            add(quiz_id, ("question", question_id), question_text)
+
+        self._postings = dict(postings)
+        self._quizzes = quizzes
+        self._built_at = time.monotonic()
+
+    def search(self, q):
+        """Return [(quiz, rank)] for quizzes matching q, best match first."""
+        query_grams = trigrams(q)
+        if not query_grams:
+            return []
+
+        with self._lock:
+            if self._built_at is None or time.monotonic() - self._built_at >= TRIGRAM_INDEX_TTL:
+                self._build()
+            postings, quizzes = self._postings, self._quizzes
+
+        # Count shared trigrams per field, only touching fields that contain
+        # at least one of the query trigrams
+        shared = defaultdict(int)
+        owners = {}
+        for gram in query_grams:
+            for quiz_id, field_id in postings.get(gram, ()):
+                shared[field_id] += 1
+                owners[field_id] = quiz_id
+
+        weights = {"title": TITLE_WEIGHT, "description": DESCRIPTION_WEIGHT, "question": QUESTION_WEIGHT}
+        ranks = {}
+        for field_id, count in shared.items():
+            # Share of the query's trigrams found in the field, like pg_trgm's
+            # word_similarity, so long fields are not penalised for their length
+            similarity = count / len(query_grams)
+            if similarity < TRIGRAM_THRESHOLD:
+                continue
+            rank = similarity * weights[field_id[0]]
+            quiz_id = owners[field_id]
+            ranks[quiz_id] = max(ranks.get(quiz_id, 0), rank)
+
+        ordered = sorted(ranks.items(), key=lambda item: (-item[1], item[0]))
+        return [(quizzes[quiz_id], rank) for quiz_id, rank in ordered]
+
+
+# One index per tenant, so a change in one tenant only rebuilds its own
+trigram_indexes = NamespacedLRU(max_entries=1, max_namespaces=TRIGRAM_MAX_TENANTS)
+
+
+def trigram_index(tenant_id):
+    index = trigram_indexes.get(tenant_id, "index")
+    if index is None:
+        index = TrigramIndex(tenant_id)
+        trigram_indexes.put(tenant_id, "index", index)
+    return index
+
+
+def invalidate_search(tenant_id):
+    trigram_indexes.clear(tenant_id)
+
+
+def search_quizzes(q, tenant_id, page=1, per_page=20):
+    """Search a tenant's quiz titles, descriptions and question text.
+
+    Returns (results, total) where results is one page of ranked quizzes.
+    """
+    offset = (page - 1) * per_page
+
+    if db.engine.dialect.name == "postgresql":
+        rows = db.session.execute(
+            POSTGRES_SEARCH_SQL, {"q": q, "tenant_id": tenant_id, "limit": per_page, "offset": offset}
+        ).all()
+        total = db.session.execute(POSTGRES_COUNT_SQL, {"q": q, "tenant_id": tenant_id}).scalar()
+        results = [{
+            "id": row.id,
+            "title": row.title,
+            "description": row.description,
+            "rank": float(row.rank)
+        } for row in rows]
+        return results, total
+
+    matches = trigram_index(tenant_id).search(q)
+    results = [dict(quiz, rank=round(rank, 4)) for quiz, rank in matches[offset:offset + per_page]]
+    return results, len(matches)
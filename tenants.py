@@ -0,0 +1,86 @@
+import threading
+from flask import current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import with_loader_criteria
+from models import db, Organizations, Quizzes
+from replicas import RoutingSession
+
+# Requests pick their organization with this header (its slug); requests
+# without it belong to the DEFAULT_TENANT organization
+TENANT_HEADER = "X-Tenant"
+
+
+class TenantResolver:
+    """Maps organization slugs to ids, caching them in-process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        event.listen(RoutingSession, "do_orm_execute", scope_to_tenant)
+
+    def tenant_id(self, slug):
+        with self._lock:
+            if slug in self._ids:
+                return self._ids[slug]
+
+        organization = Organizations.query.filter_by(slug=slug).first()
+        if organization is None and slug == current_app.config["DEFAULT_TENANT"]:
+            organization = self.create_default(slug)
+        if organization is None:
+            return None
+
+        with self._lock:
+            self._ids[slug] = organization.id
+        return organization.id
+
+    def create_default(self, slug):
+        """Create the default organization on a fresh database.
+
+        Databases created with create_tables() have no organizations yet;
+        migrated ones got theirs from the migration, so a DEFAULT_TENANT
+        changed later is reported as unknown rather than created here.
+        """
+        if Organizations.query.first() is not None:
+            return None
+        try:
+            organization = Organizations(name=slug.replace("-", " ").title(), slug=slug)
+            db.session.add(organization)
+            db.session.commit()
+            return organization
+        except IntegrityError:
+            # A concurrent first request created it
+            db.session.rollback()
+            return Organizations.query.filter_by(slug=slug).first()
+
+    def before_request(self):
+        slug = request.headers.get(TENANT_HEADER) or current_app.config["DEFAULT_TENANT"]
+        tenant_id = self.tenant_id(slug)
+        if tenant_id is None:
+            return jsonify({"message": f"Unknown tenant '{slug}'"}), 404
+        g.tenant_id = tenant_id
+
+
+tenant_resolver = TenantResolver()
+
+
+def current_tenant_id():
+    """The current request's tenant, or None outside requests (CLI, job workers)."""
+    if not has_request_context():
+        return None
+    return g.get("tenant_id")
+
+
+def scope_to_tenant(execute_state):
+    """Limit every ORM query on quizzes to the current request's tenant."""
+    if not execute_state.is_select or execute_state.execution_options.get("all_tenants"):
+        return
+    tenant_id = current_tenant_id()
+    if tenant_id is None:
+        return
+    execute_state.statement = execute_state.statement.options(
+        with_loader_criteria(Quizzes, lambda cls: cls.tenant_id == tenant_id, include_aliases=True)
+    )